@@ -7,19 +7,123 @@ including song titles, artists, and Apple Music links.
 """
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 import json
 import sqlite3
 import sys
 import re
+import functools
+import io
+import threading
+import weakref
+from contextlib import contextmanager
 from datetime import datetime
 from urllib.parse import urlparse
 
+# Prefer the C-based lxml parser; fall back to the stdlib parser if it's missing
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Prefer orjson for encoding/decoding songs_json; fall back to the stdlib json module
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    def json_dumps_pretty(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+
+    def json_dumps(obj):
+        return json.dumps(obj)
+
+    def json_dumps_pretty(obj):
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+
+    json_loads = json.loads
+
+# Only build the tags the extractors look at; skips inline SVGs, styles, etc.
+PAGE_STRAINER = SoupStrainer(["h1", "div", "a", "figure", "script", "time", "li"])
+
+# International workout URLs, e.g. https://fitness.apple.com/gb/...
+INTL_URL_RE = re.compile(r"https://fitness\.apple\.com/[a-z]{2}/(.+)")
+
+# Workout slug in a URL path, e.g. /workout/cycling-with-emily/123 -> cycling-with-emily
+WORKOUT_SLUG_RE = re.compile(r"/workout/([^/?#]+)")
+
+# Categories displayed in uppercase rather than title case
+UPPERCASE_CATEGORIES = frozenset({"hiit"})
+
+# Upper bound on page fetches in flight at once; keep this small to stay polite
+MAX_CONCURRENT_FETCHES = 4
+
+# JSON keys whose list values hold playlist entries
+SONG_LIST_KEYS = frozenset({"tracks", "songs", "playlist", "music"})
+
+# Classifies a workout metadata attribute; alternatives are tried in priority order:
+# "...min" is a duration, "Ep..." an episode, and a known type name is the workout type
+METADATA_ATTRIBUTE_RE = re.compile(
+    r"(?P<duration>.*min\Z)|(?P<episode>Ep)|(?P<workout_type>.*(?:Cycle|Strength|Yoga|HIIT))",
+    re.DOTALL,
+)
+
+# Song dict keys, in lookup priority order
+SONG_TITLE_KEYS = ("name", "title", "trackName")
+SONG_ARTIST_KEYS = ("artist", "by", "performer")
+SONG_URL_KEYS = ("url", "link")
+
+# Connection tuning applied once to the cache connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",  # ~20MB page cache
+    "PRAGMA mmap_size=134217728",  # 128MB
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_workout_category(workout_slug):
+    """Derive the display category from a workout slug"""
+    # Extract category (everything before "-with-")
+    if "-with-" in workout_slug:
+        category = workout_slug.split("-with-", 1)[0]
+    else:
+        # Fallback: try to extract from first part of slug
+        category = workout_slug.split("-", 1)[0]
+
+    # Special case: HIIT should be uppercase
+    if category.lower() in UPPERCASE_CATEGORIES:
+        return category.upper()
+
+    return category.title()  # Capitalize first letter
+
 
 class AppleFitnessScraper:
     def __init__(self, db_path="fitness_cache.db"):
         self.db_path = db_path
         self.session = requests.Session()
+        # Pool enough connections for concurrent fetches and retry transient failures
+        # with exponential backoff (Retry-After is honored for 429/503)
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         # Use a realistic User-Agent to avoid being blocked
         self.session.headers.update(
             {
@@ -32,44 +136,91 @@ class AppleFitnessScraper:
                 "Upgrade-Insecure-Requests": "1",
             }
         )
+
+        # One long-lived connection for the scraper's lifetime. Autocommit mode
+        # (isolation_level=None) so multi-statement writes use explicit BEGIN/COMMIT.
+        self.conn = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False
+        )
+        for pragma in SQLITE_PRAGMAS:
+            self.conn.execute(pragma)
+        self._db_lock = threading.RLock()
+        # Closes the connection on garbage collection or interpreter exit
+        self._finalizer = weakref.finalize(self, self.conn.close)
+
         self._init_database()
 
+    def checkpoint(self):
+        """Fold the WAL back into the main database file
+
+        Committed writes otherwise sit in the -wal file, which file-level
+        copies and git commits of the database alone would miss.
+        """
+        with self._connect() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """Optimize, checkpoint and close the database connection"""
+        if self._finalizer.alive:
+            with self._db_lock:
+                self.conn.execute("PRAGMA optimize")
+                self.checkpoint()
+                self._finalizer()
+
+    @contextmanager
+    def _connect(self):
+        """Yield the shared database connection, serialized across threads"""
+        with self._db_lock:
+            yield self.conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block of statements in a single explicit transaction"""
+        with self._db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
     def _clean_url(self, url):
         """Remove query parameters from URL"""
-        if "?" in url:
-            return url.split("?")[0]
-        return url
+        return url.partition("?")[0]
 
     def _normalize_url_to_us(self, url):
         """Convert international Apple Fitness URL to US format"""
-        # Pattern to match international URLs
-        pattern = r"https://fitness\.apple\.com/[a-z]{2}/(.+)"
-        match = re.match(pattern, url)
+        match = INTL_URL_RE.match(url)
         if match:
             return f"https://fitness.apple.com/us/{match.group(1)}"
         return url
 
-    def _get_canonical_url(self, url):
-        """Get the canonical URL by following redirects"""
+    def _get_canonical_page(self, url):
+        """Follow redirects to the canonical URL, returning it with the page body
+
+        The body is None when no request succeeded, so callers can fall back to
+        fetching the returned URL themselves.
+        """
         try:
             # First normalize to US format
             us_url = self._normalize_url_to_us(url)
 
-            # Follow redirects to get canonical URL
+            # Follow redirects to get canonical URL; the same response carries the page
             response = self.session.get(us_url, allow_redirects=True, timeout=10)
             if response.status_code == 200:
-                return response.url
+                return response.url, response.content
             else:
                 # If US version fails, try original
                 response = self.session.get(url, allow_redirects=True, timeout=10)
                 if response.status_code == 200:
-                    return response.url
+                    return response.url, response.content
         except Exception as e:
             print(f"Warning: Could not get canonical URL for {url}: {e}")
             # Fallback to normalized US URL
-            return self._normalize_url_to_us(url)
+            return self._normalize_url_to_us(url), None
 
-        return url
+        return url, None
 
     def _extract_workout_category(self, url):
         """Extract workout category from URL path"""
@@ -80,29 +231,9 @@ class AppleFitnessScraper:
         # - strength-with-kim -> strength
         # - treadmill-with-emily -> treadmill
 
-        try:
-            # Extract the workout slug from URL
-            parts = url.split("/")
-            if "workout" in parts:
-                workout_index = parts.index("workout")
-                if workout_index + 1 < len(parts):
-                    workout_slug = parts[workout_index + 1]
-
-                    # Extract category (everything before "-with-")
-                    if "-with-" in workout_slug:
-                        category = workout_slug.split("-with-")[0]
-                    else:
-                        # Fallback: try to extract from first part of slug
-                        category = workout_slug.split("-")[0]
-
-                    # Special case: HIIT should be uppercase
-                    if category.lower() == "hiit":
-                        return "HIIT"
-
-                    return category.title()  # Capitalize first letter
-
-        except (IndexError, ValueError):
-            pass
+        match = WORKOUT_SLUG_RE.search(url)
+        if match:
+            return _parse_workout_category(match.group(1))
 
         return "Unknown"
 
@@ -159,7 +290,7 @@ class AppleFitnessScraper:
 
     def _init_database(self):
         """Initialize the SQLite database for caching workout results"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
             current_schema = self._get_current_schema(conn)
             expected_schema = self._get_expected_schema()
 
@@ -175,22 +306,17 @@ class AppleFitnessScraper:
                         {", ".join(columns_sql)}
                     )
                 """)
-                conn.commit()
 
             elif not self._schemas_match(current_schema, expected_schema):
                 # Schema migration needed
                 print("Database schema migration needed - preserving existing data...")
 
-                # Get existing data
-                cursor = conn.execute("SELECT * FROM workout_cache")
-                existing_data = cursor.fetchall()
-
                 # Get column names from current schema
                 cursor = conn.execute("PRAGMA table_info(workout_cache)")
                 current_columns = [row[1] for row in cursor.fetchall()]
 
-                # Drop old table and create new one
-                conn.execute("DROP TABLE workout_cache")
+                # Move the old table aside so its rows can be copied into the new one
+                conn.execute("ALTER TABLE workout_cache RENAME TO workout_cache_old")
                 columns_sql = []
                 for col_name, col_type in expected_schema.items():
                     columns_sql.append(f"{col_name} {col_type}")
@@ -208,44 +334,35 @@ class AppleFitnessScraper:
                         url_column = col_name
                         break
 
-                # Re-insert existing data, ALL entries need update since they don't have canonical URLs
-                migrated_count = 0
-                for row in existing_data:
-                    # Create a dict from existing row data
-                    row_data = dict(zip(current_columns, row))
-
-                    # Find URL from the first column containing "url"
-                    original_url = None
-                    if url_column and row_data.get(url_column):
-                        original_url = self._clean_url(row_data[url_column])
-
-                    # ALL existing entries need update since they lack canonical URLs
-                    insert_columns = ["needs_update"]
-                    insert_values = [1]
-
-                    # Add original_url if we found one
-                    if original_url:
-                        insert_columns.append("original_url")
-                        insert_values.append(original_url)
-
-                    # Add other columns that exist in both schemas
-                    for col in expected_schema.keys():
-                        if col in row_data and col not in [
-                            "canonical_url",
-                            "original_url",
-                            "needs_update",
-                        ]:
-                            insert_columns.append(col)
-                            insert_values.append(row_data[col])
-
-                    placeholders = ", ".join(["?" for _ in insert_values])
-                    conn.execute(
-                        f"INSERT INTO workout_cache ({', '.join(insert_columns)}) VALUES ({placeholders})",
-                        insert_values,
+                # Columns carried over verbatim from the old table
+                copied_columns = [
+                    col
+                    for col in expected_schema.keys()
+                    if col in current_columns
+                    and col not in ["canonical_url", "original_url", "needs_update"]
+                ]
+
+                # original_url comes from the first "url" column, with any query string
+                # stripped in SQL (the equivalent of _clean_url)
+                if url_column:
+                    raw_url = f"NULLIF({url_column}, '')"
+                    original_url_sql = (
+                        f"CASE WHEN instr({raw_url}, '?') > 0 "
+                        f"THEN substr({raw_url}, 1, instr({raw_url}, '?') - 1) "
+                        f"ELSE {raw_url} END"
                     )
-                    migrated_count += 1
-
-                conn.commit()
+                else:
+                    original_url_sql = "NULL"
+
+                # Copy inside SQLite; ALL entries need update since they lack canonical URLs
+                insert_columns = ["needs_update", "original_url"] + copied_columns
+                select_columns = ["1", original_url_sql] + copied_columns
+                cursor = conn.execute(f"""
+                    INSERT INTO workout_cache ({", ".join(insert_columns)})
+                    SELECT {", ".join(select_columns)} FROM workout_cache_old
+                """)
+                migrated_count = cursor.rowcount
+                conn.execute("DROP TABLE workout_cache_old")
 
                 # Count entries needing update
                 cursor = conn.execute(
@@ -266,17 +383,38 @@ class AppleFitnessScraper:
                 """)
                 fixed_count = cursor.rowcount
                 if fixed_count > 0:
-                    conn.commit()
                     print(
                         f"Fixed {fixed_count} entries missing canonical URLs - marked for update."
                     )
 
+            # Secondary indexes for the original_url lookup and the pending-update scan
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_original_url ON workout_cache(original_url)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_needs_update ON workout_cache(needs_update) WHERE needs_update = 1"
+            )
+
+            # Duplicate detection groups by the effective URL; listings sort by recency
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_workout_url_coalesce ON workout_cache(COALESCE(canonical_url, original_url))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_workout_cached_at ON workout_cache(cached_at DESC)"
+            )
+
+            # Filter option lists read these columns from small partial indexes
+            for column in ("trainer", "genre", "workout_category", "duration"):
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{column} ON workout_cache({column}) WHERE {column} IS NOT NULL"
+                )
+
     def _get_cached_result(self, original_url):
         """Get cached result from database if it exists and is valid"""
         # Clean the URL first
         cleaned_url = self._clean_url(original_url)
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             # Try to find by canonical_url or original_url
             cursor = conn.execute(
                 """
@@ -303,14 +441,14 @@ class AppleFitnessScraper:
                         "date": row[7],
                         "datetime": row[8],
                     },
-                    "songs": json.loads(row[9]),
+                    "songs": json_loads(row[9]),
                     "canonical_url": row[11],
                 }
         return None
 
     def _get_entries_needing_update(self):
         """Get count and list of entries that need updating"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.execute("""
                 SELECT COUNT(*) FROM workout_cache 
                 WHERE needs_update = 1 AND (original_url IS NOT NULL OR canonical_url IS NOT NULL)
@@ -333,21 +471,22 @@ class AppleFitnessScraper:
         # Extract workout category from canonical URL
         workout_category = self._extract_workout_category(canonical_url)
 
-        with sqlite3.connect(self.db_path) as conn:
-            # First, delete any existing entries for this URL (handles both canonical_url and original_url matches)
-            # This is necessary because the primary key is canonical_url, but old entries may have canonical_url=NULL
+        with self._transaction() as conn:
+            # Drop stale rows recorded under this original URL but a different
+            # canonical_url (old entries may have canonical_url=NULL); the
+            # canonical_url conflict itself is handled by INSERT OR REPLACE
             conn.execute(
                 """
                 DELETE FROM workout_cache 
-                WHERE canonical_url = ? OR original_url = ?
+                WHERE original_url = ? AND canonical_url IS NOT ?
             """,
-                (canonical_url, cleaned_original_url),
+                (cleaned_original_url, canonical_url),
             )
 
-            # Then insert the new complete entry
+            # Insert the new complete entry, replacing any row with the same canonical_url
             conn.execute(
                 """
-                INSERT INTO workout_cache 
+                INSERT OR REPLACE INTO workout_cache 
                 (canonical_url, original_url, title, trainer, duration, genre, episode, workout_type, workout_category, date, datetime, songs_json, needs_update) 
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
             """,
@@ -363,24 +502,24 @@ class AppleFitnessScraper:
                     workout_category,
                     metadata.get("date"),
                     metadata.get("datetime"),
-                    json.dumps(workout_data["songs"]),
+                    json_dumps(workout_data["songs"]),
                 ),
             )
-            conn.commit()
 
     def fetch_workout_page(self, url):
-        """Fetch the Apple Fitness+ workout page"""
+        """Fetch the Apple Fitness+ workout page as raw bytes"""
         try:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
-            return response.text
+            # Hand the undecoded body to the parser, which detects the charset itself
+            return response.content
         except requests.RequestException as e:
             print(f"Error fetching page: {e}")
             return None
 
     def extract_workout_data(self, html_content):
-        """Extract workout metadata and songs from the HTML"""
-        soup = BeautifulSoup(html_content, "html.parser")
+        """Extract workout metadata and songs from the HTML (str or bytes)"""
+        soup = BeautifulSoup(html_content, HTML_PARSER, parse_only=PAGE_STRAINER)
 
         # Extract workout metadata
         metadata = self._extract_metadata(soup)
@@ -392,10 +531,15 @@ class AppleFitnessScraper:
         script_tags = soup.find_all("script", type="application/ld+json")
 
         for script in script_tags:
+            # Only parse blocks that carry workout data (skips BreadcrumbList, Organization, ...)
+            script_text = script.string
+            if not script_text or "workoutData" not in script_text:
+                continue
             try:
-                data = json.loads(script.string)
+                # script.string is a bs4 NavigableString subclass, which orjson rejects
+                data = json_loads(str(script_text))
                 # Look for workout data that might contain playlist info
-                if isinstance(data, dict) and "workoutData" in str(data):
+                if isinstance(data, dict):
                     songs.extend(self._extract_from_json(data))
             except (json.JSONDecodeError, TypeError):
                 continue
@@ -424,16 +568,13 @@ class AppleFitnessScraper:
                 text = attr.get_text(strip=True)
 
                 # Parse different types of metadata
-                if text.endswith("min"):
+                match = METADATA_ATTRIBUTE_RE.match(text)
+                kind = match.lastgroup if match else None
+                if kind == "duration":
                     metadata["duration"] = text
-                elif text.startswith("Ep"):
+                elif kind == "episode":
                     metadata["episode"] = text
-                elif (
-                    "Cycle" in text
-                    or "Strength" in text
-                    or "Yoga" in text
-                    or "HIIT" in text
-                ):
+                elif kind == "workout_type":
                     metadata["workout_type"] = text
                 else:
                     # Check if it's a date
@@ -447,7 +588,7 @@ class AppleFitnessScraper:
                             metadata["genre"] = text
 
         # Extract trainer name
-        trainer_link = soup.find("a", href=lambda x: x and "/trainer/" in x)
+        trainer_link = soup.select_one('a[href*="/trainer/"]')
         if trainer_link:
             metadata["trainer"] = trainer_link.get_text(strip=True)
 
@@ -457,50 +598,46 @@ class AppleFitnessScraper:
         """Extract songs from JSON data structure"""
         songs = []
 
-        def recursive_search(obj, path=""):
+        # Iterative pre-order walk; children are pushed in reverse so songs keep
+        # the same order the recursive version produced
+        stack = [(None, data)]
+        while stack:
+            key, obj = stack.pop()
+            if (
+                key is not None
+                and key.lower() in SONG_LIST_KEYS
+                and isinstance(obj, list)
+            ):
+                for item in obj:
+                    if isinstance(item, dict):
+                        song_info = self._parse_song_dict(item)
+                        if song_info:
+                            songs.append(song_info)
+
             if isinstance(obj, dict):
-                for key, value in obj.items():
-                    if key.lower() in ["tracks", "songs", "playlist", "music"]:
-                        if isinstance(value, list):
-                            for item in value:
-                                if isinstance(item, dict):
-                                    song_info = self._parse_song_dict(item)
-                                    if song_info:
-                                        songs.append(song_info)
-                    recursive_search(value, f"{path}.{key}")
+                stack.extend(reversed(obj.items()))
             elif isinstance(obj, list):
-                for i, item in enumerate(obj):
-                    recursive_search(item, f"{path}[{i}]")
+                stack.extend((None, item) for item in reversed(obj))
 
-        recursive_search(data)
         return songs
 
     def _parse_song_dict(self, song_dict):
         """Parse individual song dictionary"""
-        title = (
-            song_dict.get("name")
-            or song_dict.get("title")
-            or song_dict.get("trackName")
+        title = next((song_dict[k] for k in SONG_TITLE_KEYS if song_dict.get(k)), None)
+        apple_music_url = next(
+            (song_dict[k] for k in SONG_URL_KEYS if song_dict.get(k)), None
         )
-        artist = None
 
-        # Look for artist in various formats
-        if "artist" in song_dict:
-            artist_data = song_dict["artist"]
-            if isinstance(artist_data, dict):
-                artist = artist_data.get("name")
-            elif isinstance(artist_data, str):
-                artist = artist_data
-        elif "by" in song_dict:
-            artist = song_dict["by"]
-        elif "performer" in song_dict:
-            performer = song_dict["performer"]
-            if isinstance(performer, dict):
-                artist = performer.get("name")
-            elif isinstance(performer, str):
-                artist = performer
-
-        apple_music_url = song_dict.get("url") or song_dict.get("link")
+        # Look for artist in various formats; the first key present wins
+        artist = None
+        for key in SONG_ARTIST_KEYS:
+            if key in song_dict:
+                artist_data = song_dict[key]
+                if isinstance(artist_data, dict):
+                    artist = artist_data.get("name")
+                elif isinstance(artist_data, str):
+                    artist = artist_data
+                break
 
         if title:
             return {
@@ -515,11 +652,11 @@ class AppleFitnessScraper:
         songs = []
 
         # Look for song-lockup figures which contain the song information
-        song_figures = soup.find_all("figure", class_="song-lockup")
+        song_figures = soup.select("figure.song-lockup")
 
         for figure in song_figures:
             # Extract song title from the link
-            title_link = figure.find("a", class_="song-lockup__song-name")
+            title_link = figure.select_one("a.song-lockup__song-name")
             if not title_link:
                 continue
 
@@ -527,7 +664,7 @@ class AppleFitnessScraper:
             apple_music_url = title_link.get("href")
 
             # Extract artist name
-            artist_div = figure.find("div", class_="song-lockup__artist-name")
+            artist_div = figure.select_one("div.song-lockup__artist-name")
             artist = artist_div.get_text(strip=True) if artist_div else "Unknown Artist"
 
             if title:
@@ -554,12 +691,13 @@ class AppleFitnessScraper:
 
         print("Fetching from server...")
 
-        # Get the canonical URL for consistent metadata retrieval
-        canonical_url = self._get_canonical_url(cleaned_url)
+        # Get the canonical URL (and its page) for consistent metadata retrieval
+        canonical_url, html_content = self._get_canonical_page(cleaned_url)
         print(f"Canonical URL: {canonical_url}")
 
-        # Always fetch using the canonical URL for consistent metadata
-        html_content = self.fetch_workout_page(canonical_url)
+        # Only fetch separately if resolving the canonical URL didn't yield the page
+        if html_content is None:
+            html_content = self.fetch_workout_page(canonical_url)
         if not html_content:
             return None
 
@@ -577,37 +715,39 @@ class AppleFitnessScraper:
             return "No workout data found."
 
         if format_type.lower() == "json":
-            return json.dumps(workout_data, indent=2, ensure_ascii=False)
+            return json_dumps_pretty(workout_data)
         else:
-            output = []
+            buf = io.StringIO()
+            write = buf.write
             metadata = workout_data.get("metadata", {})
             songs = workout_data.get("songs", [])
 
             # Add workout metadata
             if metadata.get("title"):
-                output.append(f"🏋️ Workout: {metadata['title']}")
+                write(f"🏋️ Workout: {metadata['title']}\n")
             if metadata.get("trainer"):
-                output.append(f"👤 Trainer: {metadata['trainer']}")
+                write(f"👤 Trainer: {metadata['trainer']}\n")
             if metadata.get("duration"):
-                output.append(f"⏱️ Duration: {metadata['duration']}")
+                write(f"⏱️ Duration: {metadata['duration']}\n")
             if metadata.get("workout_type"):
-                output.append(f"🎯 Type: {metadata['workout_type']}")
+                write(f"🎯 Type: {metadata['workout_type']}\n")
             if metadata.get("genre"):
-                output.append(f"🎵 Genre: {metadata['genre']}")
+                write(f"🎵 Genre: {metadata['genre']}\n")
             if metadata.get("episode"):
-                output.append(f"📺 Episode: {metadata['episode']}")
+                write(f"📺 Episode: {metadata['episode']}\n")
             if metadata.get("date"):
-                output.append(f"📅 Date: {metadata['date']}")
+                write(f"📅 Date: {metadata['date']}\n")
 
             if songs:
-                output.append(f"\n🎶 Playlist ({len(songs)} songs):")
+                write(f"\n🎶 Playlist ({len(songs)} songs):\n")
                 for i, song in enumerate(songs, 1):
                     line = f'{i}. "{song["title"]}" by {song["artist"]}'
                     if song.get("apple_music_url"):
                         line += f" - {song['apple_music_url']}"
-                    output.append(line)
+                    write(line + "\n")
 
-            return "\n".join(output)
+            # Drop the newline after the last line
+            return buf.getvalue().removesuffix("\n")
 
 
 def main():
@@ -620,22 +760,24 @@ def main():
     format_type = sys.argv[2] if len(sys.argv) > 2 else "list"
 
     scraper = AppleFitnessScraper()
+    try:
+        # Check for entries needing update
+        count, urls = scraper._get_entries_needing_update()
+        if count > 0:
+            print(
+                f"📝 Note: {count} cached entries need updating (use web frontend to update them)"
+            )
+            print()
 
-    # Check for entries needing update
-    count, urls = scraper._get_entries_needing_update()
-    if count > 0:
-        print(
-            f"📝 Note: {count} cached entries need updating (use web frontend to update them)"
-        )
-        print()
-
-    workout_data = scraper.get_workout_songs(url)
+        workout_data = scraper.get_workout_songs(url)
 
-    if not workout_data or not workout_data.get("songs"):
-        print("No workout data found or unable to fetch the workout page.")
-        sys.exit(1)
+        if not workout_data or not workout_data.get("songs"):
+            print("No workout data found or unable to fetch the workout page.")
+            sys.exit(1)
 
-    print(scraper.format_output(workout_data, format_type))
+        print(scraper.format_output(workout_data, format_type))
+    finally:
+        scraper.close()
 
 
 if __name__ == "__main__":
@@ -4,19 +4,25 @@ Database Health Check Script for Apple Fitness+ Scraper
 
 This script analyzes the fitness_cache.db database and reports on its health,
 structure, and data integrity.
+
+Song statistics are computed with SQLite's JSON1 functions (json_valid,
+json_array_length), which are built into the sqlite3 library bundled with
+current Python releases.
 """
 
-import sqlite3
 import json
+import sqlite3
 import sys
 from datetime import datetime
 
+from db_utils import DEFAULT_CACHE_MB, db_argument_parser, tuned_connect
 
-def check_db_health(db_path="fitness_cache.db"):
+
+def check_db_health(db_path="fitness_cache.db", cache_mb=DEFAULT_CACHE_MB):
     """Comprehensive database health check"""
 
     try:
-        conn = sqlite3.connect(db_path)
+        conn = tuned_connect(db_path, readonly=True, cache_mb=cache_mb)
         print(f"🔍 Checking database: {db_path}")
         print("=" * 60)
 
@@ -35,38 +41,69 @@ def check_db_health(db_path="fitness_cache.db"):
             not_null = " NOT NULL" if row[3] else ""
             print(f"  {row[1]}: {row[2]}{default_val}{not_null}{pk_indicator}")
 
-        # Basic stats
+        # Indexes back the filtered counts below; partial ones only cover
+        # rows matching their WHERE clause (e.g. idx_needs_update)
+        cursor = conn.execute("PRAGMA index_list(workout_cache)")
+        for _, index_name, unique, _, partial in cursor.fetchall():
+            flags = [
+                flag for flag, on in (("unique", unique), ("partial", partial)) if on
+            ]
+            flags_str = f" ({', '.join(flags)})" if flags else ""
+            print(f"  index {index_name}{flags_str}")
+
+        # Basic stats, gathered in a single pass over the table
         print("\n=== DATABASE STATS ===")
-        cursor = conn.execute("SELECT COUNT(*) FROM workout_cache")
-        total_count = cursor.fetchone()[0]
+        cursor = conn.execute("""
+            SELECT
+                COUNT(*),
+                SUM(needs_update = 1),
+                SUM(canonical_url IS NOT NULL),
+                SUM(original_url IS NOT NULL),
+                SUM(canonical_url IS NULL AND original_url IS NULL),
+                SUM(songs_json IS NOT NULL AND songs_json NOT IN ('[]', 'null')),
+                SUM(songs_json IS NULL OR songs_json IN ('[]', 'null'))
+            FROM workout_cache
+        """)
+        (
+            total_count,
+            needs_update_count,
+            canonical_count,
+            original_count,
+            orphaned_count,
+            with_songs_count,
+            empty_songs_count,
+        ) = cursor.fetchone()
         print(f"📊 Total entries: {total_count}")
 
+        # Row estimate the query planner works from, present once ANALYZE has run
+        stat_row = None
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone():
+            stat_row = conn.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = 'workout_cache' LIMIT 1"
+            ).fetchone()
+        if stat_row:
+            print(f"📈 Planner row estimate: {stat_row[0].split()[0]}")
+
         if total_count == 0:
             print("ℹ️  Database is empty")
             return True
 
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE needs_update = 1"
-        )
-        needs_update_count = cursor.fetchone()[0]
         print(f"🔄 Entries needing update: {needs_update_count}")
-
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE canonical_url IS NOT NULL"
-        )
-        canonical_count = cursor.fetchone()[0]
         print(f"🔗 Entries with canonical URL: {canonical_count}")
-
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE original_url IS NOT NULL"
-        )
-        original_count = cursor.fetchone()[0]
         print(f"📝 Entries with original URL: {original_count}")
 
         # Sample data
         print("\n=== SAMPLE DATA ===")
+        # Song counts are computed by SQLite's JSON functions, not in Python
         cursor = conn.execute("""
-            SELECT canonical_url, original_url, title, needs_update, trainer, workout_type, workout_category, songs_json 
+            SELECT canonical_url, original_url, title, needs_update, trainer, workout_type, workout_category,
+                   CASE
+                       WHEN songs_json IS NULL OR songs_json = '' THEN 0
+                       WHEN json_valid(songs_json) THEN json_array_length(songs_json)
+                       ELSE 'ERROR'
+                   END AS songs_count
             FROM workout_cache 
             ORDER BY cached_at DESC 
             LIMIT 5
@@ -81,15 +118,8 @@ def check_db_health(db_path="fitness_cache.db"):
                 trainer,
                 workout_type,
                 workout_category,
-                songs_json,
+                songs_count,
             ) = row
-            songs_count = 0
-            if songs_json:
-                try:
-                    songs = json.loads(songs_json)
-                    songs_count = len(songs) if isinstance(songs, list) else 0
-                except:
-                    songs_count = "ERROR"
 
             print(f"{i}. {title or 'Untitled'}")
             print(f"   👤 Trainer: {trainer or 'Unknown'}")
@@ -104,32 +134,39 @@ def check_db_health(db_path="fitness_cache.db"):
         # Data integrity checks
         print("=== DATA INTEGRITY CHECKS ===")
 
+        # Page-level consistency check, done by SQLite itself
+        quick_check = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if quick_check == "ok":
+            print("✅ quick_check passed")
+        else:
+            print(f"❌ quick_check failed: {quick_check}")
+
         # Check for orphaned entries
-        cursor = conn.execute("""
-            SELECT COUNT(*) FROM workout_cache 
-            WHERE canonical_url IS NULL AND original_url IS NULL
-        """)
-        orphaned_count = cursor.fetchone()[0]
         if orphaned_count > 0:
             print(f"⚠️  Orphaned entries (no URLs): {orphaned_count}")
         else:
             print("✅ No orphaned entries found")
 
-        # Check for entries with songs
-        cursor = conn.execute("""
-            SELECT COUNT(*) FROM workout_cache 
-            WHERE songs_json IS NOT NULL AND songs_json != '[]' AND songs_json != 'null'
-        """)
-        with_songs_count = cursor.fetchone()[0]
+        # Check for entries with and without songs
         print(f"🎵 Entries with songs: {with_songs_count}")
+        print(f"🔇 Entries with no songs: {empty_songs_count}")
 
-        # Check for empty songs
+        # Song totals aggregated inside SQLite rather than decoding each row
         cursor = conn.execute("""
-            SELECT COUNT(*) FROM workout_cache 
-            WHERE songs_json IS NULL OR songs_json = '[]' OR songs_json = 'null'
+            SELECT SUM(song_count), AVG(song_count), MAX(song_count), SUM(song_count IS NULL)
+            FROM (
+                SELECT CASE WHEN json_valid(songs_json) THEN json_array_length(songs_json) END AS song_count
+                FROM workout_cache
+                WHERE songs_json IS NOT NULL AND songs_json != ''
+            )
         """)
-        empty_songs_count = cursor.fetchone()[0]
-        print(f"🔇 Entries with no songs: {empty_songs_count}")
+        total_songs, avg_songs, max_songs, invalid_json_count = cursor.fetchone()
+        if total_songs:
+            print(
+                f"🎶 Songs: {total_songs} total, {avg_songs:.1f} avg, {max_songs} max per entry"
+            )
+        if invalid_json_count:
+            print(f"❌ Entries with invalid songs JSON: {invalid_json_count}")
 
         # URL normalization check
         print("\n=== URL NORMALIZATION CHECK ===")
@@ -152,62 +189,34 @@ def check_db_health(db_path="fitness_cache.db"):
         # Content analysis
         print("=== CONTENT ANALYSIS ===")
 
-        # Trainers
+        # Distinct values for every column in a single scan; json_group_array
+        # keeps values intact even when they contain commas
         cursor = conn.execute("""
-            SELECT DISTINCT trainer 
-            FROM workout_cache 
-            WHERE trainer IS NOT NULL 
-            ORDER BY trainer
+            SELECT
+                json_group_array(DISTINCT trainer),
+                json_group_array(DISTINCT workout_category),
+                json_group_array(DISTINCT workout_type),
+                json_group_array(DISTINCT genre),
+                json_group_array(DISTINCT duration)
+            FROM workout_cache
         """)
-        trainers = [row[0] for row in cursor.fetchall()]
+        trainers, workout_categories, workout_types, genres, durations = (
+            sorted(value for value in json.loads(values) if value is not None)
+            for values in cursor.fetchone()
+        )
+
         print(
             f"👥 Trainers ({len(trainers)}): {', '.join(trainers) if trainers else 'None'}"
         )
-
-        # Workout categories
-        cursor = conn.execute("""
-            SELECT DISTINCT workout_category 
-            FROM workout_cache 
-            WHERE workout_category IS NOT NULL 
-            ORDER BY workout_category
-        """)
-        workout_categories = [row[0] for row in cursor.fetchall()]
         print(
             f"🏃 Workout categories ({len(workout_categories)}): {', '.join(workout_categories) if workout_categories else 'None'}"
         )
-
-        # Workout types
-        cursor = conn.execute("""
-            SELECT DISTINCT workout_type 
-            FROM workout_cache 
-            WHERE workout_type IS NOT NULL 
-            ORDER BY workout_type
-        """)
-        workout_types = [row[0] for row in cursor.fetchall()]
         print(
             f"🎯 Workout types ({len(workout_types)}): {', '.join(workout_types) if workout_types else 'None'}"
         )
-
-        # Genres
-        cursor = conn.execute("""
-            SELECT DISTINCT genre 
-            FROM workout_cache 
-            WHERE genre IS NOT NULL 
-            ORDER BY genre
-        """)
-        genres = [row[0] for row in cursor.fetchall()]
         print(
             f"🎵 Music genres ({len(genres)}): {', '.join(genres) if genres else 'None'}"
         )
-
-        # Durations
-        cursor = conn.execute("""
-            SELECT DISTINCT duration 
-            FROM workout_cache 
-            WHERE duration IS NOT NULL 
-            ORDER BY duration
-        """)
-        durations = [row[0] for row in cursor.fetchall()]
         print(
             f"⏱️  Durations ({len(durations)}): {', '.join(durations) if durations else 'None'}"
         )
@@ -271,6 +280,12 @@ def check_db_health(db_path="fitness_cache.db"):
             f"\n🏥 Overall health: {health_score}/{max_score} ({'Good' if health_score >= 4 else 'Needs attention'})"
         )
 
+        # Let SQLite refresh planner statistics if it needs to; this is a
+        # no-op on a read-only connection unless stats are already current
+        try:
+            conn.execute("PRAGMA optimize")
+        except sqlite3.OperationalError:
+            pass
         conn.close()
         return True
 
@@ -283,9 +298,11 @@ def check_db_health(db_path="fitness_cache.db"):
 
 
 if __name__ == "__main__":
-    db_path = sys.argv[1] if len(sys.argv) > 1 else "fitness_cache.db"
+    args = db_argument_parser(
+        "Report on the health of the workout cache database"
+    ).parse_args()
     print(
         f"🚀 Starting database health check at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     )
-    success = check_db_health(db_path)
+    success = check_db_health(args.db_path, cache_mb=args.cache_mb)
     sys.exit(0 if success else 1)
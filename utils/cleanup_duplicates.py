@@ -6,98 +6,151 @@ This script removes duplicate entries, keeping the most recent/complete version
 of each workout (the one with canonical_url populated).
 """
 
+import itertools
+import logging
+import os
 import sqlite3
 import sys
 from datetime import datetime
 
+from db_utils import DEFAULT_CACHE_MB, db_argument_parser, tuned_connect
+
+log = logging.getLogger(__name__)
+
+# Rowids deleted per executemany call
+DELETE_BATCH_SIZE = 10000
+
+# Ranks entries sharing a URL, best first.
+# Priority: 1) Has canonical_url, 2) Most recent cached_at, 3) Has category
+RANKED_ENTRIES_SQL = """
+    SELECT
+        rowid,
+        canonical_url,
+        workout_category,
+        cached_at,
+        COALESCE(canonical_url, original_url) AS url,
+        ROW_NUMBER() OVER (
+            PARTITION BY COALESCE(canonical_url, original_url)
+            ORDER BY
+                (canonical_url IS NOT NULL) DESC,
+                cached_at DESC,
+                (workout_category IS NOT NULL) DESC
+        ) AS rn,
+        COUNT(*) OVER (PARTITION BY COALESCE(canonical_url, original_url)) AS entry_count
+    FROM workout_cache
+    WHERE COALESCE(canonical_url, original_url) IS NOT NULL
+"""
+
 
-def cleanup_duplicates(db_path="fitness_cache.db"):
-    """Remove duplicate entries, keeping the best version of each"""
+def cleanup_duplicates(
+    db_path="fitness_cache.db", dry_run=False, cache_mb=DEFAULT_CACHE_MB
+):
+    """Remove duplicate entries, keeping the best version of each
+
+    Every kept and deleted entry is listed when debug logging is enabled.
+    With dry_run, the entries are reported along with the query plan but
+    nothing is deleted.
+    """
 
     try:
-        conn = sqlite3.connect(db_path)
-        print(f"🗂️  Cleaning up duplicates in: {db_path}")
+        # A dry run opens the database read-only, so it never switches the
+        # journal mode or creates the index below
+        conn = tuned_connect(db_path, readonly=dry_run, cache_mb=cache_mb)
+        log.info("🗂️  Cleaning up duplicates in: %s", db_path)
+
+        # Index the grouping expression so duplicate detection avoids a full sort
+        if not dry_run:
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_workout_url_coalesce ON workout_cache(COALESCE(canonical_url, original_url))"
+            )
+
+        # Counting, listing and deleting share one write transaction, so the
+        # entries deleted are exactly the ones reported
+        conn.execute("BEGIN IMMEDIATE")
 
         # First, let's see what we're working with
         cursor = conn.execute("SELECT COUNT(*) FROM workout_cache")
         total_before = cursor.fetchone()[0]
-        print(f"📊 Total entries before cleanup: {total_before}")
+        log.info("📊 Total entries before cleanup: %d", total_before)
 
-        # Find URLs that have duplicates
+        # Cheap check first: stops at the first duplicated URL, so a clean
+        # database skips the ranking query entirely
         cursor = conn.execute("""
-            SELECT url, COUNT(*) as count
-            FROM (
-                SELECT COALESCE(canonical_url, original_url) as url
-                FROM workout_cache
-                WHERE url IS NOT NULL
+            SELECT EXISTS (
+                SELECT 1 FROM workout_cache
+                WHERE COALESCE(canonical_url, original_url) IS NOT NULL
+                GROUP BY COALESCE(canonical_url, original_url)
+                HAVING COUNT(*) > 1
             )
-            GROUP BY url
-            HAVING COUNT(*) > 1
         """)
+        if not cursor.fetchone()[0]:
+            conn.execute("COMMIT")
+            log.info("✅ No duplicates found!")
+            return True
 
-        duplicates = cursor.fetchall()
-        print(f"🔍 Found {len(duplicates)} URLs with duplicates")
-
-        if not duplicates:
-            print("✅ No duplicates found!")
+        # Rank every entry within its URL group and list the groups with duplicates
+        cursor = conn.execute(f"""
+            SELECT url, entry_count, rn, rowid, canonical_url, workout_category, cached_at
+            FROM ({RANKED_ENTRIES_SQL})
+            WHERE entry_count > 1
+            ORDER BY url, rn
+        """)
+        ranked_entries = cursor.fetchall()
+
+        duplicate_urls = {entry[0] for entry in ranked_entries}
+        log.info("🔍 Found %d URLs with duplicates", len(duplicate_urls))
+
+        # Per-entry details are only built when debug logging is on, and logged in one go
+        if log.isEnabledFor(logging.DEBUG):
+            # Entries come back best-first within each URL: keep the first, delete the rest
+            lines = []
+            current_url = None
+            for url, count, _, rowid, canonical, category, cached_at in ranked_entries:
+                details = (
+                    f"rowid={rowid}, canonical={canonical is not None}, "
+                    f"category={category}, cached_at={cached_at}"
+                )
+                if url != current_url:
+                    current_url = url
+                    lines.append(f"\n🔄 Processing {url} ({count} entries)...")
+                    lines.append(f"   ✅ Keeping: {details}")
+                else:
+                    lines.append(f"   🗑️  Deleting: {details}")
+            log.debug("%s", "\n".join(lines))
+
+        # Delete exactly the entries listed above with a single prepared
+        # statement, batched to cap memory per executemany call
+        rowids_to_delete = [entry[3] for entry in ranked_entries if entry[2] > 1]
+
+        if dry_run:
+            conn.execute("ROLLBACK")
+            log.info("🧪 Dry run: %d entries would be deleted", len(rowids_to_delete))
+            log.info("📋 Ranking query plan:")
+            cursor = conn.execute(f"EXPLAIN QUERY PLAN {RANKED_ENTRIES_SQL}")
+            for _, _, _, detail in cursor.fetchall():
+                log.info("   %s", detail)
+            conn.close()
             return True
 
         deleted_count = 0
-
-        for url, count in duplicates:
-            print(f"\n🔄 Processing {url} ({count} entries)...")
-
-            # Get all entries for this URL, ordered by preference
-            # Priority: 1) Has canonical_url, 2) Most recent cached_at, 3) Has category
-            cursor = conn.execute(
-                """
-                SELECT rowid, canonical_url, original_url, needs_update, workout_category, cached_at
-                FROM workout_cache 
-                WHERE canonical_url = ? OR original_url = ?
-                ORDER BY 
-                    (canonical_url IS NOT NULL) DESC,
-                    cached_at DESC,
-                    (workout_category IS NOT NULL) DESC
-            """,
-                (url, url),
-            )
-
-            entries = cursor.fetchall()
-
-            if len(entries) <= 1:
-                continue
-
-            # Keep the first entry (best one), delete the rest
-            keep_entry = entries[0]
-            delete_entries = entries[1:]
-
-            print(
-                f"   ✅ Keeping: rowid={keep_entry[0]}, canonical={keep_entry[1] is not None}, "
-                f"category={keep_entry[4]}, cached_at={keep_entry[5]}"
+        rowid_iter = iter(rowids_to_delete)
+        while batch := list(itertools.islice(rowid_iter, DELETE_BATCH_SIZE)):
+            cursor = conn.executemany(
+                "DELETE FROM workout_cache WHERE rowid = ?",
+                [(rowid,) for rowid in batch],
             )
-
-            for delete_entry in delete_entries:
-                print(
-                    f"   🗑️  Deleting: rowid={delete_entry[0]}, canonical={delete_entry[1] is not None}, "
-                    f"category={delete_entry[4]}, cached_at={delete_entry[5]}"
-                )
-
-                cursor = conn.execute(
-                    "DELETE FROM workout_cache WHERE rowid = ?", (delete_entry[0],)
-                )
-                deleted_count += 1
-
-        conn.commit()
+            deleted_count += cursor.rowcount
+        conn.execute("COMMIT")
 
         # Final stats
         cursor = conn.execute("SELECT COUNT(*) FROM workout_cache")
         total_after = cursor.fetchone()[0]
 
-        print(f"\n📊 Cleanup Summary:")
-        print(f"   Entries before: {total_before}")
-        print(f"   Entries deleted: {deleted_count}")
-        print(f"   Entries after: {total_after}")
-        print(f"   Space saved: {deleted_count} duplicate entries")
+        log.info("\n📊 Cleanup Summary:")
+        log.info("   Entries before: %d", total_before)
+        log.info("   Entries deleted: %d", deleted_count)
+        log.info("   Entries after: %d", total_after)
+        log.info("   Space saved: %d duplicate entries", deleted_count)
 
         # Verify no duplicates remain
         cursor = conn.execute("""
@@ -115,38 +168,57 @@ def cleanup_duplicates(db_path="fitness_cache.db"):
 
         remaining_duplicates = cursor.fetchone()[0]
         if remaining_duplicates == 0:
-            print("✅ All duplicates successfully removed!")
+            log.info("✅ All duplicates successfully removed!")
         else:
-            print(f"⚠️  Warning: {remaining_duplicates} URLs still have duplicates")
+            log.warning(
+                "⚠️  Warning: %d URLs still have duplicates", remaining_duplicates
+            )
 
+        # Refresh planner statistics for the indexes used above, then fold the
+        # WAL into the database file so copies of the file alone are complete
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
         conn.close()
         return True
 
     except sqlite3.Error as e:
-        print(f"❌ Database error: {e}")
+        log.error("❌ Database error: %s", e)
         return False
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
+        log.error("❌ Unexpected error: %s", e)
         return False
 
 
 def main():
     """Main function"""
-    db_path = sys.argv[1] if len(sys.argv) > 1 else "fitness_cache.db"
+    parser = db_argument_parser("Remove duplicate workout cache entries")
+    parser.add_argument(
+        "--verbose", action="store_true", help="list every kept and deleted entry"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report duplicates without deleting"
+    )
+    args = parser.parse_args()
+
+    # Messages go to stdout; LOGLEVEL=WARNING silences the report, --verbose adds detail
+    level = "DEBUG" if args.verbose else os.environ.get("LOGLEVEL", "INFO").upper()
+    logging.basicConfig(level=level, format="%(message)s", stream=sys.stdout)
 
-    print(
-        f"🚀 Starting duplicate cleanup at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    log.info(
+        "🚀 Starting duplicate cleanup at %s", datetime.now().replace(microsecond=0)
     )
-    print("=" * 60)
+    log.info("=" * 60)
 
-    success = cleanup_duplicates(db_path)
+    success = cleanup_duplicates(
+        args.db_path, dry_run=args.dry_run, cache_mb=args.cache_mb
+    )
 
-    print("\n" + "=" * 60)
+    log.info("\n" + "=" * 60)
     if success:
-        print("✅ Duplicate cleanup completed successfully")
-        print("💡 Tip: Run check_db_health.py to verify the database state")
+        log.info("✅ Duplicate cleanup completed successfully")
+        log.info("💡 Tip: Run check_db_health.py to verify the database state")
     else:
-        print("❌ Duplicate cleanup failed")
+        log.error("❌ Duplicate cleanup failed")
 
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,54 @@
+"""
+Shared SQLite connection helper for the database maintenance scripts
+"""
+
+import argparse
+import sqlite3
+from pathlib import Path
+
+DEFAULT_CACHE_MB = 64
+
+
+def db_argument_parser(description):
+    """Argument parser with the database path and cache size shared by all scripts"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "db_path",
+        nargs="?",
+        default="fitness_cache.db",
+        help="SQLite database to use (default: fitness_cache.db)",
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=DEFAULT_CACHE_MB,
+        help=f"SQLite page cache size in MB (default: {DEFAULT_CACHE_MB})",
+    )
+    return parser
+
+
+def tuned_connect(
+    db_path="fitness_cache.db", readonly=False, cache_mb=DEFAULT_CACHE_MB
+):
+    """Open a connection with performance PRAGMAs applied
+
+    The connection is in autocommit mode: callers group writes with an explicit
+    BEGIN IMMEDIATE ... COMMIT. Read-only connections skip the journal/sync
+    settings, which need write access.
+    """
+    if readonly:
+        # as_uri() percent-encodes characters like "?" and "#" in the path
+        conn = sqlite3.connect(
+            Path(db_path).resolve().as_uri() + "?mode=ro",
+            uri=True,
+            isolation_level=None,
+        )
+    else:
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    conn.execute(f"PRAGMA cache_size={-cache_mb * 1024}")  # negative means KiB
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+    return conn
@@ -1,40 +1,78 @@
 #!/usr/bin/env python3
 """Fetch Apple Fitness+ page HTML for local development"""
 
+import argparse
 import requests
-import sys
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+}
+
+# Concurrent fetches when several URLs are given; matches the connection pool size
+MAX_WORKERS = 4
+
+# Shared session so repeated fetches reuse keep-alive connections
+SESSION = requests.Session()
+SESSION.mount(
+    "https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+)
 
-def fetch_page(url, output_file):
-    """Fetch the HTML page and save it locally"""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/120.0.0.0 Safari/537.36"
-    }
 
+def fetch_page(url, output_file):
+    """Fetch the HTML page and stream it to a local file"""
     try:
         print(f"Fetching {url}...")
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        with SESSION.get(url, headers=HEADERS, timeout=10, stream=True) as response:
+            response.raise_for_status()
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(response.text)
+            # Write the bytes as served, preserving the page's own encoding
+            size = 0
+            with open(output_file, "wb") as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    size += len(chunk)
 
         print(f"HTML saved to {output_file}")
-        print(f"File size: {len(response.text)} characters")
+        print(f"File size: {size} bytes")
 
     except requests.RequestException as e:
         print(f"Error fetching page: {e}")
 
 
 if __name__ == "__main__":
-    url = "https://fitness.apple.com/us/workout/cycling-with-emily/1810544460"
-    output_file = "workout_page.html"
-
-    if len(sys.argv) > 1:
-        url = sys.argv[1]
-    if len(sys.argv) > 2:
-        output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "urls",
+        nargs="*",
+        default=["https://fitness.apple.com/us/workout/cycling-with-emily/1810544460"],
+        help="workout page URLs to fetch",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="workout_page.html",
+        help="file name when fetching a single URL (default: workout_page.html)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=Path("."),
+        help="directory to save pages in (default: current directory)",
+    )
+    args = parser.parse_args()
 
-    fetch_page(url, output_file)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    if len(args.urls) == 1:
+        fetch_page(args.urls[0], args.output_dir / args.output)
+    else:
+        output_files = [
+            args.output_dir / f"workout_page_{i}.html"
+            for i in range(1, len(args.urls) + 1)
+        ]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            list(executor.map(fetch_page, args.urls, output_files))
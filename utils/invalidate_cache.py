@@ -10,32 +10,32 @@ import sqlite3
 import sys
 from datetime import datetime
 
+from db_utils import DEFAULT_CACHE_MB, db_argument_parser, tuned_connect
 
-def invalidate_all_cache(db_path="fitness_cache.db"):
+
+def invalidate_all_cache(db_path="fitness_cache.db", cache_mb=DEFAULT_CACHE_MB):
     """Mark all cache entries as needing update"""
 
     try:
-        conn = sqlite3.connect(db_path)
+        conn = tuned_connect(db_path, cache_mb=cache_mb)
         print(f"🗂️  Connecting to database: {db_path}")
 
-        # Check current state
-        cursor = conn.execute("SELECT COUNT(*) FROM workout_cache")
-        total_count = cursor.fetchone()[0]
+        # Index the rows the pre-check and UPDATE care about
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_needs_update_valid ON workout_cache(needs_update) WHERE needs_update = 0"
+        )
+
+        # Check current state in a single pass
+        cursor = conn.execute("""
+            SELECT COUNT(*), SUM(needs_update = 0), SUM(needs_update = 1)
+            FROM workout_cache
+        """)
+        total_count, valid_count, invalid_count = cursor.fetchone()
 
         if total_count == 0:
             print("ℹ️  Database is empty - nothing to invalidate")
             return True
 
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE needs_update = 0"
-        )
-        valid_count = cursor.fetchone()[0]
-
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE needs_update = 1"
-        )
-        invalid_count = cursor.fetchone()[0]
-
         print(f"📊 Current state:")
         print(f"   Total entries: {total_count}")
         print(f"   Valid entries: {valid_count}")
@@ -51,23 +51,22 @@ def invalidate_all_cache(db_path="fitness_cache.db"):
             "   This means they will be re-scraped from Apple Fitness+ on next access."
         )
 
-        # Perform invalidation
-        cursor = conn.execute("UPDATE workout_cache SET needs_update = 1")
+        # Perform invalidation in one write transaction, only rewriting rows
+        # that are still valid
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(
+            "UPDATE workout_cache SET needs_update = 1 WHERE needs_update = 0"
+        )
         updated_count = cursor.rowcount
-        conn.commit()
+        conn.execute("COMMIT")
 
         print(f"✅ Successfully invalidated {updated_count} cache entries")
 
         # Verify results
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE needs_update = 1"
-        )
-        final_invalid_count = cursor.fetchone()[0]
-
-        cursor = conn.execute(
-            "SELECT COUNT(*) FROM workout_cache WHERE needs_update = 0"
-        )
-        final_valid_count = cursor.fetchone()[0]
+        cursor = conn.execute("""
+            SELECT SUM(needs_update = 1), SUM(needs_update = 0) FROM workout_cache
+        """)
+        final_invalid_count, final_valid_count = cursor.fetchone()
 
         print(f"📊 Final state:")
         print(f"   Entries needing update: {final_invalid_count}")
@@ -78,6 +77,8 @@ def invalidate_all_cache(db_path="fitness_cache.db"):
         else:
             print(f"⚠️  Warning: {final_valid_count} entries still marked as valid")
 
+        # Fold the WAL into the database file so copies of the file alone are complete
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
         conn.close()
         return True
 
@@ -91,14 +92,16 @@ def invalidate_all_cache(db_path="fitness_cache.db"):
 
 def main():
     """Main function"""
-    db_path = sys.argv[1] if len(sys.argv) > 1 else "fitness_cache.db"
+    args = db_argument_parser(
+        "Mark every workout cache entry as needing update"
+    ).parse_args()
 
     print(
         f"🚀 Starting cache invalidation at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     )
     print("=" * 60)
 
-    success = invalidate_all_cache(db_path)
+    success = invalidate_all_cache(args.db_path, cache_mb=args.cache_mb)
 
     print("\n" + "=" * 60)
     if success:
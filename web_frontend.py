@@ -4,16 +4,63 @@ Web frontend for Apple Fitness+ workout playlist scraper
 """
 
 from flask import Flask, render_template, request, jsonify, send_from_directory
-import time
+import bisect
+import functools
+import hashlib
+import re
+import atexit
+import queue
+import sqlite3
 import threading
-from queue import Queue
-from apple_fitness_scraper import AppleFitnessScraper
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from apple_fitness_scraper import (
+    AppleFitnessScraper,
+    MAX_CONCURRENT_FETCHES,
+    SQLITE_PRAGMAS,
+    json_loads,
+)
 import os
 
 app = Flask(__name__)
 
-# Global variables for processing state
-processing_queue = Queue()
+# Serve JSON through orjson when it's installed; Flask's stdlib provider otherwise
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        """JSON provider that encodes responses straight to bytes with orjson"""
+
+        option = orjson.OPT_SORT_KEYS
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default, option=self.option),
+                mimetype=self.mimetype,
+            )
+
+    app.json = OrjsonProvider(app)
+except ImportError:
+    pass
+
+# Duration buckets in minutes; a duration up to DURATION_THRESHOLDS[i] maps to
+# DURATION_BUCKETS[i], anything longer to the last bucket
+DURATION_RE = re.compile(r"(\d+)")
+DURATION_THRESHOLDS = (7, 15, 25, 37)
+DURATION_BUCKETS = (5, 10, 20, 30, 45)
+
+# Global variables for processing state. processing_status is never mutated
+# in place: run_batch publishes a fresh snapshot dict, so readers always see
+# a consistent status without locking.
 processing_status = {
     "is_processing": False,
     "current_url": "",
@@ -24,170 +71,277 @@ processing_status = {
 }
 
 
-def process_urls_worker():
-    """Background worker to process URLs with rate limiting"""
-    global processing_status
+# Minimum time in seconds between the starts of consecutive server requests
+REQUEST_INTERVAL = 2.0
+# Monotonic time before which the next server request must not start; only
+# touched by the batch thread, and kept across batches
+next_request_at = 0.0
+
+
+# One scraper shared by batch processing and all requests; its database access is
+# serialized internally, so the connection and page cache stay warm
+SCRAPER = AppleFitnessScraper()
+atexit.register(SCRAPER.close)
+
+# Read connections for request handlers. Each request checks one out of the
+# pool and returns it, so connections (and their page caches) are reused
+# across requests whichever thread serves them; at most READ_POOL_SIZE idle
+# connections are kept, extras opened under load are closed on return.
+# On top of the scraper's settings they get a larger page cache and memory
+# map, which persist while the connection sits in the pool
+READ_POOL_SIZE = 4
+READ_CONN_PRAGMAS = (
+    "PRAGMA cache_size=-65536",  # 64MB page cache
+    "PRAGMA mmap_size=268435456",  # 256MB, overriding the scraper's 128MB
+)
+_read_pool = queue.LifoQueue(maxsize=READ_POOL_SIZE)
+
 
-    scraper = AppleFitnessScraper()
+@contextmanager
+def _read_conn():
+    """Check a read connection out of the pool, opening one if none is idle"""
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = sqlite3.connect(
+            SCRAPER.db_path, isolation_level=None, check_same_thread=False
+        )
+        for pragma in SQLITE_PRAGMAS + READ_CONN_PRAGMAS:
+            conn.execute(pragma)
+    try:
+        yield conn
+    finally:
+        try:
+            _read_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
+
+@atexit.register
+def _close_read_pool():
+    """Close idle pooled connections at interpreter exit"""
     while True:
-        if not processing_queue.empty():
-            queue_item = processing_queue.get()
-
-            # Handle both old format (just URLs) and new format (URLs, force_refresh)
-            if isinstance(queue_item, tuple):
-                urls, force_refresh = queue_item
-            else:
-                urls = queue_item
-                force_refresh = False
-
-            processing_status["is_processing"] = True
-            processing_status["completed"] = 0
-            processing_status["total"] = len(urls)
-            processing_status["results"] = []
-            processing_status["errors"] = []
-
-            for i, url in enumerate(urls):
-                if url is None:
+        try:
+            _read_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def _update_status(**changes):
+    """Publish a new processing_status snapshot with the given fields changed"""
+    global processing_status
+    processing_status = {**processing_status, **changes}
+
+
+def run_batch(urls, force_refresh=False):
+    """Process a batch of URLs with rate limiting, publishing progress as it goes"""
+    global next_request_at
+
+    scraper = SCRAPER
+    try:
+        urls = [url.strip() for url in urls if url and url.strip()]
+
+        # Accumulated locally; each published snapshot gets its own copy
+        results = []
+        errors = []
+        _update_status(
+            is_processing=True, completed=0, total=len(urls), results=[], errors=[]
+        )
+
+        def record_fetch(url, songs, error):
+            """Record the outcome of a finished server fetch"""
+            try:
+                if error is not None:
+                    errors.append({"url": url, "error": str(error)})
+                elif songs:
+                    # songs_json may hold JSON null, so "songs" can be None
+                    song_count = len(songs.get("songs") or [])
+                    status_msg = "Refreshed" if force_refresh else "Scraped"
+                    results.append(
+                        {
+                            "url": url,
+                            "status": "success",
+                            "songs": song_count,
+                            "message": f"{status_msg} {song_count} songs",
+                        }
+                    )
+                else:
+                    errors.append(
+                        {
+                            "url": url,
+                            "error": "No songs found or page unavailable",
+                        }
+                    )
+            except Exception as e:
+                errors.append({"url": url, "error": str(e)})
+            _update_status(
+                completed=len(results) + len(errors),
+                results=results[:],
+                errors=errors[:],
+            )
+
+        # Cache pass: answer everything already cached (unless force refresh
+        # is enabled) up front, without waiting behind any server request
+        urls_to_fetch = []
+        for url in urls:
+            _update_status(current_url=url)
+            try:
+                cached_songs = (
+                    None if force_refresh else scraper._get_cached_result(url)
+                )
+                if not cached_songs:
+                    urls_to_fetch.append(url)
                     continue
-                url = url.strip()
-                if not url:
+                results.append(
+                    {
+                        "url": url,
+                        "status": "cached",
+                        "songs": len(cached_songs.get("songs") or []),
+                        "message": "Found in cache",
+                    }
+                )
+            except Exception as e:
+                errors.append({"url": url, "error": str(e)})
+            _update_status(
+                completed=len(results) + len(errors),
+                results=results[:],
+                errors=errors[:],
+            )
+
+        # Network pass: request starts stay REQUEST_INTERVAL apart, but a slow
+        # fetch no longer delays the next one; at most MAX_CONCURRENT_FETCHES
+        # are in flight, and fetches that finish while waiting for the next
+        # slot are reported straight away. Fetches run on daemon threads so an
+        # in-flight request never holds up interpreter exit.
+        finished = queue.Queue()
+
+        def fetch(url):
+            try:
+                finished.put((url, scraper.get_workout_songs(url), None))
+            except Exception as e:
+                finished.put((url, None, e))
+
+        in_flight = 0
+        for url in urls_to_fetch:
+            while True:
+                delay = next_request_at - time.monotonic()
+                slot_free = in_flight < MAX_CONCURRENT_FETCHES
+                if slot_free and delay <= 0:
+                    break
+                if not in_flight:
+                    time.sleep(delay)
                     continue
+                try:
+                    record_fetch(*finished.get(timeout=delay if slot_free else None))
+                    in_flight -= 1
+                except queue.Empty:
+                    pass
+            next_request_at = time.monotonic() + REQUEST_INTERVAL
 
-                processing_status["current_url"] = url
+            _update_status(current_url=url)
+            threading.Thread(target=fetch, args=(url,), daemon=True).start()
+            in_flight += 1
 
-                try:
-                    # Check if already cached (unless force refresh is enabled)
-                    cached_songs = (
-                        None if force_refresh else scraper._get_cached_result(url)
-                    )
-                    made_server_request = False
-
-                    if cached_songs:
-                        processing_status["results"].append(
-                            {
-                                "url": url,
-                                "status": "cached",
-                                "songs": len(cached_songs.get("songs", [])),
-                                "message": "Found in cache",
-                            }
-                        )
-                    else:
-                        # Fetch from server
-                        made_server_request = True
-                        songs = scraper.get_workout_songs(url)
-                        if songs:
-                            status_msg = "Refreshed" if force_refresh else "Scraped"
-                            processing_status["results"].append(
-                                {
-                                    "url": url,
-                                    "status": "success",
-                                    "songs": len(songs.get("songs", [])),
-                                    "message": f"{status_msg} {len(songs.get('songs', []))} songs",
-                                }
-                            )
-                        else:
-                            processing_status["errors"].append(
-                                {
-                                    "url": url,
-                                    "error": "No songs found or page unavailable",
-                                }
-                            )
-
-                except Exception as e:
-                    processing_status["errors"].append({"url": url, "error": str(e)})
-
-                processing_status["completed"] = i + 1
-
-                # Rate limiting: only wait after server requests (not cache hits)
-                if made_server_request and i < len(urls) - 1:
-                    time.sleep(2)
-
-            processing_status["is_processing"] = False
-            processing_status["current_url"] = ""
-            processing_queue.task_done()
-        else:
-            time.sleep(1)
-
-
-# Start background worker
-worker_thread = threading.Thread(target=process_urls_worker, daemon=True)
-worker_thread.start()
+        for _ in range(in_flight):
+            record_fetch(*finished.get())
+
+        # Keep the database file self-contained for backups between batches
+        scraper.checkpoint()
+    finally:
+        _update_status(is_processing=False, current_url="")
+
+
+# Future of the most recently started batch. Batches run one at a time, since
+# they share the request spacing and the published processing_status;
+# _job_lock makes checking for a running batch and starting one atomic
+current_job = None
+_job_lock = threading.Lock()
+
+
+def _run_job(job, urls, force_refresh):
+    """Run one batch and resolve its Future with the outcome"""
+    try:
+        run_batch(urls, force_refresh)
+    except Exception as e:
+        app.logger.exception("Batch processing failed")
+        job.set_exception(e)
+    else:
+        job.set_result(None)
+
+
+def _start_job(urls, force_refresh):
+    """Start a batch on its own thread and return its Future
+
+    The thread is a daemon, unlike ThreadPoolExecutor workers, which are joined
+    at interpreter exit; stopping or reloading the server never waits for a batch.
+    """
+    job = Future()
+    job.set_running_or_notify_cancel()
+    threading.Thread(
+        target=_run_job, args=(job, urls, force_refresh), daemon=True
+    ).start()
+    return job
 
 
 @app.route("/")
 def index():
     """Main page - Workout Library"""
-    scraper = AppleFitnessScraper()
-
-    import sqlite3
-
-    with sqlite3.connect(scraper.db_path) as conn:
-        cursor = conn.execute("""
-            SELECT COALESCE(canonical_url, original_url) as display_url, 
-                   original_url,
-                   canonical_url, title, trainer, duration, genre, episode, workout_type, workout_category, date, datetime, 
-                   cached_at, songs_json, needs_update, is_favorite
+    # Only the columns the template shows are read, already named as the
+    # template expects. Song counts come from SQLite's JSON functions, and
+    # songs_json that isn't a valid JSON array is filtered out there so one
+    # bad row can't break the page. Rows are consumed as they are read
+    # rather than materialized up front.
+    with _read_conn() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute("""
+            SELECT COALESCE(canonical_url, original_url) as url,
+                   COALESCE(NULLIF(title, ''), 'Unknown Workout') as title,
+                   trainer, duration, genre, episode, workout_category, date, cached_at,
+                   CASE WHEN json_valid(songs_json) THEN
+                       CASE json_type(songs_json) WHEN 'array' THEN songs_json END
+                   END as songs_json,
+                   CASE WHEN json_valid(songs_json) THEN json_array_length(songs_json) ELSE 0 END as song_count,
+                   needs_update, is_favorite
             FROM workout_cache 
             ORDER BY cached_at DESC
         """)
-        rows = cursor.fetchall()
-
-    cache_data = []
-    for row in rows:
-        (
-            display_url,
-            original_url,
-            canonical_url,
-            title,
-            trainer,
-            duration,
-            genre,
-            episode,
-            workout_type,
-            workout_category,
-            date,
-            datetime_val,
-            cached_at,
-            songs_json,
-            needs_update,
-            is_favorite,
-        ) = row
-
-        songs = []
-        if songs_json:
-            import json
-
-            songs = json.loads(songs_json)
-
-        duration_bucket = normalize_duration(duration)
-
-        cache_data.append(
-            {
-                "url": display_url,  # Show canonical URL primarily
-                "original_url": original_url,  # Keep original for reference
-                "canonical_url": canonical_url,
-                "title": title or "Unknown Workout",
-                "trainer": trainer,
-                "duration": duration,
-                "duration_bucket": duration_bucket,
-                "genre": genre,
-                "episode": episode,
-                "workout_type": workout_type,
-                "workout_category": workout_category,
-                "date": date,
-                "datetime": datetime_val,
-                "cached_at": cached_at,
-                "song_count": len(songs),
-                "songs": songs,
-                "needs_update": bool(needs_update),
-                "is_favorite": bool(is_favorite),
-            }
-        )
+
+        cache_data = []
+        for row in cursor:
+            workout = dict(row)
+
+            # Songs are still needed in full: the template renders them for search
+            songs_json = workout.pop("songs_json")
+            workout["songs"] = json_loads(songs_json) if songs_json else []
+
+            workout["duration_bucket"] = normalize_duration(workout["duration"])
+            workout["needs_update"] = bool(workout["needs_update"])
+            workout["is_favorite"] = bool(workout["is_favorite"])
+            cache_data.append(workout)
 
     return render_template("index.html", cache_data=cache_data)
 
 
+def _enqueue(urls, force_refresh, message):
+    """Start a batch unless one is already running, and report the outcome"""
+    global current_job
+    with _job_lock:
+        if current_job is not None and not current_job.done():
+            return jsonify({"error": "Already processing URLs. Please wait."}), 400
+
+        # Show the batch as running right away, before its thread is scheduled.
+        # Once the thread starts, run_batch clears the flag however it ends
+        _update_status(is_processing=True)
+        try:
+            current_job = _start_job(urls, force_refresh)
+        except RuntimeError:
+            _update_status(is_processing=False)
+            raise
+
+    return jsonify({"message": message})
+
+
 @app.route("/process", methods=["POST"])
 def process_urls():
     """Handle URL processing request"""
@@ -198,13 +352,7 @@ def process_urls():
     if not urls:
         return jsonify({"error": "No valid URLs provided"}), 400
 
-    if processing_status["is_processing"]:
-        return jsonify({"error": "Already processing URLs. Please wait."}), 400
-
-    # Add URLs to processing queue with force_refresh flag
-    processing_queue.put((urls, force_refresh))
-
-    return jsonify({"message": f"Started processing {len(urls)} URLs"})
+    return _enqueue(urls, force_refresh, f"Started processing {len(urls)} URLs")
 
 
 @app.route("/status")
@@ -216,7 +364,7 @@ def get_status():
 @app.route("/pending-updates")
 def get_pending_updates():
     """Get list of entries that need updating"""
-    scraper = AppleFitnessScraper()
+    scraper = SCRAPER
     count, urls = scraper._get_entries_needing_update()
     return jsonify({"count": count, "urls": urls})
 
@@ -224,19 +372,14 @@ def get_pending_updates():
 @app.route("/update-pending", methods=["POST"])
 def update_pending():
     """Update all pending entries"""
-    scraper = AppleFitnessScraper()
+    scraper = SCRAPER
     count, urls = scraper._get_entries_needing_update()
 
     if not urls:
         return jsonify({"message": "No entries need updating"}), 400
 
-    if processing_status["is_processing"]:
-        return jsonify({"error": "Already processing URLs. Please wait."}), 400
-
-    # Add URLs to processing queue (always force refresh for pending updates)
-    processing_queue.put((urls, True))
-
-    return jsonify({"message": f"Started updating {len(urls)} pending entries"})
+    # Always force refresh for pending updates
+    return _enqueue(urls, True, f"Started updating {len(urls)} pending entries")
 
 
 @app.route("/update-single", methods=["POST"])
@@ -248,13 +391,8 @@ def update_single():
     if not url:
         return jsonify({"error": "No URL provided"}), 400
 
-    if processing_status["is_processing"]:
-        return jsonify({"error": "Already processing URLs. Please wait."}), 400
-
-    # Add single URL to processing queue (always force refresh for individual updates)
-    processing_queue.put(([url], True))
-
-    return jsonify({"message": f"Started updating: {url}"})
+    # Always force refresh for individual updates
+    return _enqueue([url], True, f"Started updating: {url}")
 
 
 @app.route("/toggle-favorite", methods=["POST"])
@@ -266,9 +404,7 @@ def toggle_favorite():
     if not url:
         return jsonify({"error": "No URL provided"}), 400
 
-    scraper = AppleFitnessScraper()
-
-    import sqlite3
+    scraper = SCRAPER
 
     try:
         with sqlite3.connect(scraper.db_path) as conn:
@@ -302,31 +438,17 @@ def toggle_favorite():
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
 
+# Distinct duration strings are few, while the library page buckets every row
+@functools.lru_cache(maxsize=128)
 def normalize_duration(duration_str):
     """Normalize duration to standard buckets: 5, 10, 20, 30, 45 minutes"""
-    if not duration_str:
-        return None
-
     # Extract number from duration string (e.g., "45min" -> 45)
-    import re
-
-    match = re.search(r"(\d+)", duration_str)
+    match = DURATION_RE.search(duration_str) if duration_str else None
     if not match:
         return None
 
     minutes = int(match.group(1))
-
-    # Map to buckets
-    if minutes <= 7:
-        return 5
-    elif minutes <= 15:
-        return 10
-    elif minutes <= 25:
-        return 20
-    elif minutes <= 37:
-        return 30
-    else:
-        return 45
+    return DURATION_BUCKETS[bisect.bisect_left(DURATION_THRESHOLDS, minutes)]
 
 
 @app.route("/add")
@@ -338,49 +460,50 @@ def add_workouts():
 @app.route("/filter-options")
 def get_filter_options():
     """Get unique filter options for trainers, genres, and durations"""
-    scraper = AppleFitnessScraper()
-
-    import sqlite3
-
-    with sqlite3.connect(scraper.db_path) as conn:
-        # Get unique trainers
-        cursor = conn.execute(
-            "SELECT DISTINCT trainer FROM workout_cache WHERE trainer IS NOT NULL ORDER BY trainer"
-        )
-        trainers = [row[0] for row in cursor.fetchall()]
-
-        # Get unique genres
-        cursor = conn.execute(
-            "SELECT DISTINCT genre FROM workout_cache WHERE genre IS NOT NULL ORDER BY genre"
-        )
-        genres = [row[0] for row in cursor.fetchall()]
+    with _read_conn() as conn:
+        # The options only change when rows are added, replaced (new rowid and
+        # cached_at) or removed, so that state doubles as the response's ETag
+        max_rowid, row_count, last_cached_at = conn.execute(
+            "SELECT MAX(rowid), COUNT(*), MAX(cached_at) FROM workout_cache"
+        ).fetchone()
+        etag = hashlib.blake2b(
+            f"{max_rowid}:{row_count}:{last_cached_at}".encode(), digest_size=8
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        # One round-trip for every option list, each tagged with the filter it
+        # belongs to. Distinct durations are bucketed with normalize_duration,
+        # so the options match the buckets shown on the library page.
+        cursor = conn.execute("""
+            SELECT 'trainers', trainer FROM workout_cache WHERE trainer IS NOT NULL
+            UNION
+            SELECT 'genres', genre FROM workout_cache WHERE genre IS NOT NULL
+            UNION
+            SELECT 'workout_categories', workout_category FROM workout_cache
+            WHERE workout_category IS NOT NULL
+            UNION
+            SELECT 'durations', duration FROM workout_cache WHERE duration IS NOT NULL
+            ORDER BY 1, 2
+        """)
+        options = {
+            "trainers": [],
+            "genres": [],
+            "workout_categories": [],
+            "durations": [],
+        }
+        for option_type, value in cursor:
+            options[option_type].append(value)
 
-        # Get unique workout categories
-        cursor = conn.execute(
-            "SELECT DISTINCT workout_category FROM workout_cache WHERE workout_category IS NOT NULL ORDER BY workout_category"
-        )
-        workout_categories = [row[0] for row in cursor.fetchall()]
+    buckets = {normalize_duration(duration) for duration in options["durations"]}
+    buckets.discard(None)
+    options["durations"] = sorted(buckets)
 
-        # Get all durations and normalize them
-        cursor = conn.execute(
-            "SELECT DISTINCT duration FROM workout_cache WHERE duration IS NOT NULL"
-        )
-        duration_buckets = set()
-        for row in cursor.fetchall():
-            bucket = normalize_duration(row[0])
-            if bucket:
-                duration_buckets.add(bucket)
-
-        durations = sorted(list(duration_buckets))
-
-    return jsonify(
-        {
-            "trainers": trainers,
-            "genres": genres,
-            "workout_categories": workout_categories,
-            "durations": durations,
-        }
-    )
+    response = jsonify(options)
+    response.set_etag(etag)
+    return response
 
 
 if __name__ == "__main__":